@@ -1,33 +1,99 @@
 from fastapi import FastAPI, APIRouter, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator, Final, Deque
 import uuid
-from datetime import datetime
-import openai
-from openai import OpenAI
+from datetime import datetime, timedelta, timezone
+import httpx
+from openai import AsyncOpenAI
 import asyncio
+from collections import deque
 import json
+import orjson
+import hashlib
+import re
+import time
+import numpy as np
+from pymongo.errors import BulkWriteError
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection, one pool per worker process
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+mongo_client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '10')),
+    # Return stored timestamps as aware UTC datetimes, like the ones we write
+    tz_aware=True
+)
+db = mongo_client[os.environ['DB_NAME']]
 
 # OpenAI configuration
 openai_api_key = os.environ.get('OPENAI_API_KEY', '')
-client = OpenAI(api_key=openai_api_key) if openai_api_key else None
+# Long-lived HTTP/2 pool so OpenAI calls reuse warm connections instead of
+# paying a TCP and TLS handshake under bursts
+openai_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=httpx.Timeout(60.0, connect=5.0)
+) if openai_api_key else None
+openai_client = AsyncOpenAI(api_key=openai_api_key, http_client=openai_http_client) if openai_api_key else None
+# gpt-4o family models get automatic prompt prefix caching
+OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_TEMPERATURE = 0.1
+OPENAI_MAX_TOKENS = 2000
+
+# Account-wide OpenAI limits, split evenly across server workers
+OPENAI_RPM = int(os.environ.get('OPENAI_RPM', '0'))
+OPENAI_TPM = int(os.environ.get('OPENAI_TPM', '0'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# Concurrency caps: in-flight OpenAI calls per worker, and in-flight AI
+# requests admitted by the endpoints (cache hits included)
+OPENAI_SEM = asyncio.Semaphore(int(os.environ.get('OPENAI_CONCURRENCY', '4')))
+ENDPOINT_SEM = asyncio.Semaphore(int(os.environ.get('ENDPOINT_CONCURRENCY', '32')))
+
+# Outstanding OpenAI calls by LLM cache key, for request coalescing
+INFLIGHT: Dict[str, asyncio.Task] = {}
+
+# LLM response cache: enabled (read + write), read-only (no writes),
+# replay (no OpenAI calls, a miss is an error) or disabled
+CACHE_MODE = os.environ.get('CACHE_MODE', 'enabled').lower()
+
+# Semantic cache for free-form prompts: a hit needs cosine similarity above
+# an adaptive threshold that is tuned from user feedback towards the target
+# quality rate. Never used in replay mode.
+SEMANTIC_CACHE = os.environ.get('SEMANTIC_CACHE', 'enabled').lower() == 'enabled'
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_THRESHOLD = float(os.environ.get('SEMANTIC_THRESHOLD', '0.93'))
+SEMANTIC_TARGET_QUALITY = float(os.environ.get('SEMANTIC_TARGET_QUALITY', '0.8'))
+SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE', '5000'))
+SEMANTIC_TUNE_INTERVAL = int(os.environ.get('SEMANTIC_TUNE_INTERVAL', '60'))
+# Batched writes can land after a newer entry; each sync rereads this window
+SEMANTIC_SYNC_OVERLAP = timedelta(seconds=int(os.environ.get('SEMANTIC_SYNC_OVERLAP', '60')))
+
+# Non-critical inserts are queued and written in batches off the request path
+WRITE_BATCH_SIZE = 100
+WRITE_FLUSH_INTERVAL = 0.05  # seconds
+write_queue: asyncio.Queue = asyncio.Queue(maxsize=10000)
 
 # Create the main app without a prefix
-app = FastAPI(title="CodeCraft API", description="AI-powered code generation and debugging platform")
+# orjson renders the multi-KB code payloads several times faster than json
+app = FastAPI(
+    title="CodeCraft API",
+    description="AI-powered code generation and debugging platform",
+    default_response_class=ORJSONResponse
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -39,7 +105,7 @@ class CodeRequest(BaseModel):
     language: str = "javascript"
     request_type: str = "generate"  # generate, debug, explain, optimize
     code_input: Optional[str] = None
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class CodeResponse(BaseModel):
     id: str
@@ -47,7 +113,9 @@ class CodeResponse(BaseModel):
     generated_code: str
     explanation: str
     language: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    # Set on semantic cache hits so the client can rate the answer
+    cache_key: Optional[str] = None
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class CodeRequestCreate(BaseModel):
     prompt: str
@@ -60,72 +128,379 @@ class DebugRequest(BaseModel):
     language: str
     error_message: Optional[str] = None
 
+class ExplainRequest(BaseModel):
+    code: str
+    language: str
+
 class OptimizeRequest(BaseModel):
     code: str
     language: str
     optimization_type: str = "performance"  # performance, readability, security
 
-# AI Code Generation Functions
-async def generate_code_with_ai(prompt: str, language: str, request_type: str, code_input: Optional[str] = None) -> Dict[str, str]:
-    """Generate code using OpenAI GPT"""
+class CacheFeedback(BaseModel):
+    cache_key: str
+    high_quality: bool
+
+# System prompts
+# Each prefix is a static, language-agnostic constant so OpenAI's automatic
+# prompt caching can reuse it across calls; per-request details (language,
+# task, code) only ever appear in the user message after it.
+_SHARED_GUIDANCE = """You are CodeCraft, an expert software engineer embedded in an AI-powered code generation and debugging platform. You work across many programming languages and frameworks, including JavaScript, TypeScript, Python, React, HTML, CSS, SQL, JSON, Bash, Node.js, PHP, Java, C#, Go and Rust. The target language for each request is given on the first line of the user message in the form "Language: <name>". Always answer in that language and follow its idioms, even when the request text mentions other technologies.
+
+GENERAL PRINCIPLES
+1. Correctness first. Code you produce must be syntactically valid for the target language and must run as written, assuming only the dependencies you explicitly import or mention.
+2. Production quality. Prefer clear structure, meaningful names, small focused functions and explicit error handling over clever one-liners. Validate inputs at the boundaries of the code you write.
+3. Idiomatic style. Follow the dominant community conventions of the target language: PEP 8 and type hints for Python, modern ES modules and const/let for JavaScript, strict typing for TypeScript, functional components and hooks for React, gofmt layout for Go, rustfmt layout and Result-based error handling for Rust, PSR-12 for PHP, standard naming conventions for Java and C#, and POSIX-compatible constructs for Bash unless the user asks otherwise.
+4. Security by default. Never hard-code secrets, credentials or tokens; read them from configuration or environment variables. Use parameterized queries for SQL, escape or sanitize untrusted input before rendering it, and avoid shell injection when invoking external commands.
+5. Minimal dependencies. Use the standard library where it is sufficient. When a third-party package is genuinely needed, choose a well-known, actively maintained one and name it in a comment near the import.
+6. Comments that matter. Add short comments where intent is not obvious from the code itself, and a brief docstring or header comment for public functions, classes and modules. Do not narrate trivial statements.
+7. Determinism. Do not invent APIs, library functions or configuration options. If something depends on the user's environment, state the assumption in a single comment rather than guessing silently.
+8. Scope discipline. Do exactly what the request asks. Do not add unrelated features, rename the user's identifiers without reason, or change public interfaces that the request did not mention.
+
+FORMATTING CONTRACT
+- Write code as plain source text. Do not wrap the whole response in Markdown code fences unless the task instructions below ask for prose with embedded code.
+- Use consistent indentation: four spaces for Python, two spaces for JavaScript, TypeScript, React, HTML, CSS and JSON, tabs for Go, and the language default elsewhere.
+- Keep lines reasonably short and group imports at the top of the file in the order the language community expects.
+- When several files are required, separate them with a single comment line naming the file, for example "// File: src/api/client.js" or "# File: app/models.py".
+- Never include apologies, greetings, sign-offs or questions back to the user. If the request is ambiguous, choose the most common interpretation and proceed.
+
+LANGUAGE NOTES
+- JavaScript and Node.js: prefer async/await over raw promise chains, use strict equality, handle rejected promises, and use CommonJS only when the surrounding request clearly targets it.
+- TypeScript: avoid "any", declare interfaces or types for public data shapes, and enable narrowing with explicit type guards.
+- React: keep components pure, derive values instead of duplicating state, list every dependency of useEffect and useCallback, and give list items stable keys.
+- Python: target Python 3.10 or later, use type hints on public functions, prefer pathlib for file paths, context managers for resources and f-strings for formatting.
+- SQL: write ANSI SQL unless a dialect is named, qualify ambiguous columns, and prefer explicit JOIN clauses over comma joins.
+- HTML and CSS: use semantic elements, accessible labels and alt text, and avoid inline styles when a class would do.
+- Bash: start scripts with "set -euo pipefail", quote every variable expansion and check required commands before using them.
+- Java and C#: respect access modifiers, prefer immutable value objects, and close resources with try-with-resources or using statements.
+- Go: return errors instead of panicking, wrap them with context, and keep goroutines cancellable through a context.Context.
+- Rust: avoid unwrap and expect outside tests and examples, propagate errors with the ? operator, and prefer borrowing over cloning.
+- PHP: enable strict types, use prepared statements for database access and escape output with htmlspecialchars.
+- JSON: emit strictly valid JSON with double-quoted keys and no trailing commas or comments.
+
+QUALITY CHECKLIST
+Before answering, silently verify that: every identifier you use is defined or imported; error paths return or raise something meaningful for the caller; resources such as files, sockets and database connections are closed or managed by a context construct; asynchronous code awaits what it starts; and the result would pass a typical linter for the target language without warnings.
+
+"""
+
+SYSTEM_PREFIX_GENERATE = _SHARED_GUIDANCE + """TASK: GENERATE
+Generate clean, production-ready code that fulfils the user's request. Provide complete, functional code with proper error handling, comments and best practices.
+- Produce a complete, self-contained solution rather than a fragment, including the imports, type definitions and helper functions it needs.
+- When the request describes a component, endpoint, class or script, include a minimal usage example as a commented block at the end only if it helps the user integrate the code.
+- Favour readability over brevity, but avoid boilerplate that does not serve the request.
+- For React, export a single functional component by default and keep state local unless the request asks for shared state.
+- For HTTP APIs, return appropriate status codes, validate request bodies and handle unexpected errors with a consistent error shape.
+- For data-processing code, handle empty inputs and malformed records explicitly.
+Keep any explanation brief unless the user asks for more."""
+
+SYSTEM_PREFIX_DEBUG = _SHARED_GUIDANCE + """TASK: DEBUG
+Analyze the provided code and fix any issues. The user message contains the code to debug and, when available, the error message it produces.
+- Identify the root cause rather than masking symptoms. Consider syntax errors, runtime exceptions, off-by-one errors, incorrect types, unhandled promise rejections, race conditions, resource leaks and incorrect API usage.
+- If the error message points at a specific line or symbol, start your analysis there, but also fix any other definite bugs you find along the way.
+- Preserve the original structure, naming and public interface of the code wherever possible so the fix is easy to review.
+- Do not rewrite working code purely for style.
+- Keep the explanation short and concrete: name each problem, say why it fails and say what the fix changes.
+Explain what was wrong and provide the corrected version.
+The corrected code must be the complete, runnable program or module, not a diff."""
+
+SYSTEM_PREFIX_EXPLAIN = _SHARED_GUIDANCE + """TASK: EXPLAIN
+Explain the provided code in detail. This task produces prose, so short Markdown headings, bullet lists and inline code are allowed.
+- Start with a one-paragraph summary of what the code does and when it would be used.
+- Break down what each part does in the order it executes, referring to functions, classes and variables by name.
+- Explain the logic behind non-obvious decisions, including algorithms, data structures and control flow.
+- Point out side effects such as network calls, file access, global state mutation or database writes.
+- Provide insights about best practices: note potential bugs, edge cases, performance concerns and security issues, and suggest improvements without rewriting the whole program.
+- Adjust depth to the size of the code: a few sentences for a short snippet, a structured walkthrough for a larger module."""
+
+SYSTEM_PREFIX_OPTIMIZE = _SHARED_GUIDANCE + """TASK: OPTIMIZE
+Optimize the provided code for better performance, readability and maintainability. The user message names the optimization focus, which is one of performance, readability or security; prioritise that focus while keeping the others in mind.
+- Preserve the observable behaviour and public interface of the original code unless a change is required to fix a bug, and say so when it is.
+- For performance, reduce algorithmic complexity first, then avoid repeated work, unnecessary allocations, blocking I/O and redundant network or database round-trips.
+- For readability, simplify control flow, extract well-named helpers, remove dead code and make data flow explicit.
+- For security, validate and sanitize inputs, remove injection risks, avoid leaking sensitive data in logs or errors and follow least-privilege principles.
+- Do not micro-optimize at the expense of clarity when the gain is negligible.
+Explain the optimizations made and provide the improved version."""
+
+# Output contracts, appended after the task so the shared prefix stays cacheable
+JSON_OUTPUT_FORMAT = """
+
+OUTPUT FORMAT
+Return valid JSON with keys code, explanation and nothing else. Both values are strings.
+- "code": the complete resulting code as plain source text, without Markdown fences. For EXPLAIN tasks this is an empty string.
+- "explanation": the explanation of the result. For EXPLAIN tasks this holds the full explanation."""
+
+TEXT_OUTPUT_FORMAT = """
+
+OUTPUT FORMAT
+Return only the resulting code as plain source text, without explanations. For EXPLAIN tasks return only the explanation."""
+
+_TASK_PREFIXES = {
+    "generate": SYSTEM_PREFIX_GENERATE,
+    "debug": SYSTEM_PREFIX_DEBUG,
+    "explain": SYSTEM_PREFIX_EXPLAIN,
+    "optimize": SYSTEM_PREFIX_OPTIMIZE,
+}
+
+# Structured (JSON mode) prompts for regular calls, plain text ones for streaming
+SYSTEM_PROMPTS: Final[Dict[str, str]] = {
+    request_type: prefix + JSON_OUTPUT_FORMAT for request_type, prefix in _TASK_PREFIXES.items()
+}
+STREAM_SYSTEM_PROMPTS: Final[Dict[str, str]] = {
+    request_type: prefix + TEXT_OUTPUT_FORMAT for request_type, prefix in _TASK_PREFIXES.items()
+}
+
+# Background Database Writes
+async def enqueue_write(collection: str, document: Dict[str, Any]) -> None:
+    """Queue a document for insertion; waits only if the queue is full"""
+    await write_queue.put((collection, document))
+
+async def flush_writes(batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+    by_collection: Dict[str, List[Dict[str, Any]]] = {}
+    for collection, document in batch:
+        by_collection.setdefault(collection, []).append(document)
+    for collection, documents in by_collection.items():
+        try:
+            await db[collection].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys are expected when cache entries race
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if errors:
+                logging.error(f"Batched write error on {collection}: {errors}")
+        except Exception as e:
+            logging.error(f"Batched write error on {collection}: {str(e)}")
+
+async def drain_write_queue() -> None:
+    """Background loop: flush every WRITE_BATCH_SIZE documents or WRITE_FLUSH_INTERVAL.
+    
+    A None item stops the loop once the batch in progress has been flushed.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await write_queue.get()
+        if item is None:
+            return
+        batch = [item]
+        stopping = False
+        deadline = loop.time() + WRITE_FLUSH_INTERVAL
+        while len(batch) < WRITE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(write_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        await flush_writes(batch)
+        if stopping:
+            return
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a request has no cached response"""
+
+class CompletionError(Exception):
+    """Raised when OpenAI returns a truncated or malformed structured completion"""
+
+# LLM Response Cache
+def llm_cache_key(system_prompt: str, prompt: str, language: str, request_type: str, code_input: Optional[str] = None, structured: bool = True) -> str:
+    """Deterministic cache key over everything that shapes the completion"""
+    # Hashing the system prompt retires cached answers whenever a prompt is edited;
+    # structured separates JSON-mode results from plain text streaming ones
+    system_digest = hashlib.sha256(system_prompt.encode()).hexdigest()
+    payload = [system_digest, prompt, language, request_type, code_input, structured, OPENAI_MODEL, OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def get_cached_response(key: str) -> Optional[Dict[str, str]]:
+    """Look up a cached completion, honoring CACHE_MODE"""
+    if CACHE_MODE == "disabled":
+        return None
     try:
-        if not client:
-            # Fallback templates when no API key
-            return await get_template_code(prompt, language, request_type)
-        
-        # Construct the system prompt based on request type
-        if request_type == "generate":
-            system_prompt = f"""You are an expert {language} developer. Generate clean, production-ready code based on the user's request. 
-            Provide complete, functional code with proper error handling, comments, and best practices.
-            Return only the code without explanations unless specifically asked."""
-            
-        elif request_type == "debug":
-            system_prompt = f"""You are an expert {language} debugger. Analyze the provided code and fix any issues.
-            Explain what was wrong and provide the corrected version.
-            Format your response as: ISSUE: [explanation] FIXED CODE: [corrected code]"""
-            
-        elif request_type == "explain":
-            system_prompt = f"""You are an expert {language} developer. Explain the provided code in detail.
-            Break down what each part does, explain the logic, and provide insights about best practices."""
-            
-        elif request_type == "optimize":
-            system_prompt = f"""You are an expert {language} developer. Optimize the provided code for better performance, readability, and maintainability.
-            Explain the optimizations made and provide the improved version."""
-        
-        user_message = prompt
-        if code_input:
-            user_message = f"{prompt}\n\nCode to work with:\n```{language}\n{code_input}\n```"
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=2000,
-            temperature=0.1
-        )
-        
-        ai_response = response.choices[0].message.content
-        
-        # Parse response for debug requests
-        if request_type == "debug" and "FIXED CODE:" in ai_response:
-            parts = ai_response.split("FIXED CODE:")
-            explanation = parts[0].replace("ISSUE:", "").strip()
-            code = parts[1].strip()
-            return {"code": code, "explanation": explanation}
-        else:
-            return {"code": ai_response, "explanation": "Code generated successfully"}
-            
+        cached = await db.llm_cache.find_one({"_id": key})
     except Exception as e:
-        logging.error(f"AI generation error: {str(e)}")
-        return await get_template_code(prompt, language, request_type)
+        if CACHE_MODE == "replay":
+            raise
+        logging.error(f"LLM cache lookup error: {str(e)}")
+        return None
+    if cached:
+        return cached["response"]
+    if CACHE_MODE == "replay":
+        raise CacheMissError(f"No cached response for key {key}")
+    return None
 
-async def get_template_code(prompt: str, language: str, request_type: str) -> Dict[str, str]:
-    """Fallback template-based code generation"""
-    templates = {
-        "javascript": {
-            "react_component": """import React, { useState, useEffect } from 'react';
+async def store_cached_response(key: str, result: Dict[str, str]) -> None:
+    """Persist a completion unless the cache is read-only"""
+    if CACHE_MODE != "enabled":
+        return
+    await enqueue_write("llm_cache", {"_id": key, "response": result, "ts": datetime.now(timezone.utc)})
+
+# Semantic Cache
+class SemanticCache:
+    """In-process embedding index over cached completions, per worker"""
+
+    def __init__(self, threshold: float, target_quality: float, max_entries: int):
+        self.threshold = threshold
+        self.target_quality = target_quality
+        self.max_entries = max_entries
+        self.last_sync: Optional[datetime] = None
+        # (request_type, language) -> parallel lists of keys, responses and unit vectors
+        self._buckets: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._keys = set()
+        # Bucket of every entry in insertion order; max_entries caps the total
+        self._order: Deque[Tuple[str, str]] = deque()
+
+    def add(self, key: str, request_type: str, language: str, embedding: List[float], response: Dict[str, str]) -> None:
+        if key in self._keys:
+            return
+        bucket_id = (request_type, language)
+        bucket = self._buckets.setdefault(bucket_id, {"keys": [], "responses": [], "vectors": [], "matrix": None})
+        vector = np.asarray(embedding, dtype=np.float32)
+        bucket["keys"].append(key)
+        bucket["responses"].append(response)
+        bucket["vectors"].append(vector / np.linalg.norm(vector))
+        bucket["matrix"] = None
+        self._keys.add(key)
+        self._order.append(bucket_id)
+        if len(self._order) > self.max_entries:
+            self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        # The oldest entry overall is always the first one in its bucket
+        bucket_id = self._order.popleft()
+        bucket = self._buckets[bucket_id]
+        self._keys.discard(bucket["keys"].pop(0))
+        bucket["responses"].pop(0)
+        bucket["vectors"].pop(0)
+        bucket["matrix"] = None
+        if not bucket["keys"]:
+            del self._buckets[bucket_id]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def search(self, request_type: str, language: str, embedding: List[float]) -> Optional[Tuple[str, Dict[str, str]]]:
+        """Return the most similar cached (key, response) above the threshold"""
+        bucket = self._buckets.get((request_type, language))
+        if not bucket or not bucket["keys"]:
+            return None
+        if bucket["matrix"] is None:
+            bucket["matrix"] = np.vstack(bucket["vectors"])
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = bucket["matrix"] @ (query / np.linalg.norm(query))
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return bucket["keys"][best], bucket["responses"][best]
+
+    def adjust_threshold(self, high_quality: int, low_quality: int, step: float = 0.01) -> None:
+        """Nudge the threshold so the observed hit quality tracks the target"""
+        if high_quality + low_quality == 0:
+            return
+        quality_rate = high_quality / (high_quality + low_quality)
+        if quality_rate < self.target_quality:
+            self.threshold = round(min(self.threshold + step, 0.99), 4)
+        else:
+            self.threshold = round(max(self.threshold - step, 0.80), 4)
+
+semantic_cache = SemanticCache(SEMANTIC_THRESHOLD, SEMANTIC_TARGET_QUALITY, SEMANTIC_CACHE_SIZE)
+
+async def embed_prompt(prompt: str) -> List[float]:
+    async with OPENAI_SEM:
+        response = await openai_client.embeddings.create(model=EMBEDDING_MODEL, input=prompt)
+    return response.data[0].embedding
+
+async def store_semantic_response(key: str, request_type: str, language: str, embedding: List[float], result: Dict[str, str]) -> None:
+    """Index a completion locally and persist it for the other workers"""
+    semantic_cache.add(key, request_type, language, embedding, result)
+    if CACHE_MODE != "enabled":
+        return
+    await enqueue_write("llm_semantic_cache", {
+        "_id": key,
+        "request_type": request_type,
+        "language": language,
+        "embedding": embedding,
+        "response": result,
+        "ts": datetime.now(timezone.utc)
+    })
+
+async def sync_semantic_cache() -> None:
+    """Load semantic cache entries written since the last sync"""
+    # Entries already loaded are skipped by SemanticCache.add
+    query = {"ts": {"$gt": semantic_cache.last_sync - SEMANTIC_SYNC_OVERLAP}} if semantic_cache.last_sync else {}
+    docs = await db.llm_semantic_cache.find(query).sort("ts", -1).limit(SEMANTIC_CACHE_SIZE).to_list(SEMANTIC_CACHE_SIZE)
+    for doc in reversed(docs):
+        semantic_cache.add(doc["_id"], doc["request_type"], doc["language"], doc["embedding"], doc["response"])
+    if docs:
+        semantic_cache.last_sync = docs[0]["ts"]
+
+async def tune_semantic_cache() -> None:
+    """Background loop: adapt the threshold from recent feedback and pick up new entries"""
+    since = datetime.now(timezone.utc)
+    while True:
+        await asyncio.sleep(SEMANTIC_TUNE_INTERVAL)
+        try:
+            now = datetime.now(timezone.utc)
+            window = {"ts": {"$gte": since, "$lt": now}}
+            high_quality = await db.cache_feedback.count_documents({**window, "high_quality": True})
+            low_quality = await db.cache_feedback.count_documents({**window, "high_quality": False})
+            since = now
+            semantic_cache.adjust_threshold(high_quality, low_quality)
+            await sync_semantic_cache()
+        except Exception as e:
+            logging.error(f"Semantic cache tuning error: {str(e)}")
+
+# OpenAI Rate Limiting
+class OpenAITokenBucket:
+    """Continuously refilling request and token budget for one worker"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.request_capacity = requests_per_minute
+        self.token_capacity = tokens_per_minute
+        self.request_tokens = requests_per_minute
+        self.token_tokens = tokens_per_minute
+        self.last_update = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.request_tokens = min(self.request_capacity, self.request_tokens + elapsed * self.request_capacity / 60)
+        self.token_tokens = min(self.token_capacity, self.token_tokens + elapsed * self.token_capacity / 60)
+        self.last_update = now
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Wait until one request and estimated_tokens tokens are available"""
+        # A call costing more than a full bucket (a share below 1 RPM, or a prompt
+        # above the TPM share) is admitted once the bucket is full and charged in
+        # full, leaving a debt that refills at the configured rate
+        request_threshold = min(1, self.request_capacity)
+        token_threshold = min(estimated_tokens, self.token_capacity)
+        # Waiting while holding the lock keeps callers in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.request_tokens >= request_threshold and self.token_tokens >= token_threshold:
+                    self.request_tokens -= 1
+                    self.token_tokens -= estimated_tokens
+                    return
+                wait = max(
+                    (request_threshold - self.request_tokens) * 60 / self.request_capacity,
+                    (token_threshold - self.token_tokens) * 60 / self.token_capacity,
+                )
+                await asyncio.sleep(wait)
+
+# Rate limiting is enabled only when both account limits are configured
+openai_bucket = (
+    OpenAITokenBucket(OPENAI_RPM / WEB_CONCURRENCY, OPENAI_TPM / WEB_CONCURRENCY)
+    if OPENAI_RPM and OPENAI_TPM else None
+)
+
+# Fallback Templates
+TEMPLATES: Final[Dict[str, Dict[str, str]]] = {
+    "javascript": {
+        "react": """import React, { useState, useEffect } from 'react';
 
 const MyComponent = () => {
   const [data, setData] = useState(null);
@@ -147,7 +522,7 @@ const MyComponent = () => {
 };
 
 export default MyComponent;""",
-            "api_endpoint": """const express = require('express');
+        "api": """const express = require('express');
 const router = express.Router();
 
 // GET endpoint
@@ -172,7 +547,7 @@ router.post('/api/data', async (req, res) => {
 });
 
 module.exports = router;""",
-            "function": """function myFunction(param1, param2) {
+        "function": """function myFunction(param1, param2) {
   // Add your logic here
   try {
     const result = param1 + param2;
@@ -182,9 +557,9 @@ module.exports = router;""",
     return null;
   }
 }"""
-        },
-        "python": {
-            "function": """def my_function(param1, param2):
+    },
+    "python": {
+        "function": """def my_function(param1, param2):
     \"\"\"
     Description of the function
     
@@ -201,7 +576,7 @@ module.exports = router;""",
     except Exception as e:
         print(f"Error: {e}")
         return None""",
-            "class": """class MyClass:
+        "class": """class MyClass:
     def __init__(self, name):
         self.name = name
         self.data = []
@@ -217,7 +592,7 @@ module.exports = router;""",
     
     def __str__(self):
         return f"MyClass(name={self.name}, items={len(self.data)})\"""",
-            "api": """from fastapi import FastAPI, HTTPException
+        "api": """from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -239,25 +614,200 @@ async def create_item(item: Item):
 @app.get("/api/items/{item_id}")
 async def get_item(item_id: int):
     return {"item_id": item_id}"""
-        }
     }
+}
+
+# Template tags: a prompt is scanned once and the highest-priority tag wins
+TEMPLATE_CLASSIFIER = re.compile(
+    r"\b(?:(?P<react>react|components?)|(?P<api>apis?|endpoints?|servers?)"
+    r"|(?P<function>functions?)|(?P<class>class(?:es)?))\b",
+    re.IGNORECASE
+)
+TEMPLATE_PRIORITY = ("react", "api", "function", "class")
+TEMPLATE_EXPLANATIONS = {
+    "react": "Generated React component template",
+    "api": "Generated API template",
+    "function": "Generated function template",
+    "class": "Generated class template",
+}
+
+# AI Code Generation Functions
+def build_messages(prompt: str, language: str, request_type: str, code_input: Optional[str] = None, structured: bool = True) -> Tuple[str, str]:
+    """Return the (system prompt, user message) pair for a request"""
+    system_prompt = (SYSTEM_PROMPTS if structured else STREAM_SYSTEM_PROMPTS)[request_type]
+    user_message = prompt
+    if code_input:
+        user_message = f"{prompt}\n\nCode to work with:\n```{language}\n{code_input}\n```"
+    user_message = f"Language: {language}\n{user_message}"
+    return system_prompt, user_message
+
+def completion_params(system_prompt: str, user_message: str, request_type: str, structured: bool = True) -> Dict[str, Any]:
+    params = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ],
+        "max_tokens": OPENAI_MAX_TOKENS,
+        "temperature": OPENAI_TEMPERATURE,
+        # Route same-type requests to the same cache shard
+        "extra_body": {"prompt_cache_key": request_type}
+    }
+    if structured:
+        params["response_format"] = {"type": "json_object"}
+    return params
+
+def parse_ai_response(request_type: str, ai_response: str, structured: bool = True) -> Dict[str, str]:
+    if structured:
+        try:
+            payload = json.loads(ai_response)
+        except json.JSONDecodeError as e:
+            raise CompletionError(f"OpenAI returned invalid JSON: {str(e)}") from e
+        if not isinstance(payload, dict) or not isinstance(payload.get("code"), str) or not isinstance(payload.get("explanation"), str):
+            raise CompletionError("OpenAI response lacks string code and explanation fields")
+        return {"code": payload["code"], "explanation": payload["explanation"]}
+    # Plain text streams carry either the code or, for explain, the explanation
+    if request_type == "explain":
+        return {"code": "", "explanation": ai_response}
+    return {"code": ai_response, "explanation": "Code generated successfully"}
+
+async def acquire_rate_limit(system_prompt: str, user_message: str) -> None:
+    if openai_bucket:
+        # Rough prompt size (about 4 characters per token) plus the completion budget
+        await openai_bucket.acquire((len(system_prompt) + len(user_message)) // 4 + OPENAI_MAX_TOKENS)
+
+async def request_completion(cache_key: str, system_prompt: str, user_message: str, request_type: str) -> Dict[str, str]:
+    """Call OpenAI under the rate limits and cache the parsed result"""
+    await acquire_rate_limit(system_prompt, user_message)
+    async with OPENAI_SEM:
+        response = await openai_client.chat.completions.create(**completion_params(system_prompt, user_message, request_type))
     
-    # Simple template matching
-    prompt_lower = prompt.lower()
+    choice = response.choices[0]
+    # JSON cut off at max_tokens cannot be parsed; say so instead of falling back to a template
+    if choice.finish_reason == "length":
+        raise CompletionError(f"Response exceeded the {OPENAI_MAX_TOKENS} token limit; try a smaller request")
+    result = parse_ai_response(request_type, choice.message.content)
+    await store_cached_response(cache_key, result)
+    return result
+
+async def complete_uncached(cache_key: str, prompt: str, system_prompt: str, user_message: str, request_type: str, language: str, code_input: Optional[str]) -> Dict[str, str]:
+    """Answer an exact-cache miss from the semantic cache or a new completion"""
+    # Semantic matching only makes sense for free-form prompts
+    embedding = None
+    if SEMANTIC_CACHE and CACHE_MODE in ("enabled", "read-only") and not code_input:
+        try:
+            embedding = await embed_prompt(prompt)
+        except Exception as e:
+            logging.error(f"Prompt embedding error: {str(e)}")
+        if embedding is not None:
+            match = semantic_cache.search(request_type, language, embedding)
+            if match:
+                match_key, match_response = match
+                # An exact repeat can land here before its llm_cache write flushes;
+                # only genuine semantic hits are offered for rating
+                if match_key == cache_key:
+                    return match_response
+                return {**match_response, "cache_key": match_key}
     
-    if language in templates:
-        if "react" in prompt_lower or "component" in prompt_lower:
-            return {"code": templates[language].get("react_component", "// Template not available"), 
-                   "explanation": "Generated React component template"}
-        elif "api" in prompt_lower or "endpoint" in prompt_lower or "server" in prompt_lower:
-            return {"code": templates[language].get("api", templates[language].get("api_endpoint", "// Template not available")), 
-                   "explanation": "Generated API template"}
-        elif "function" in prompt_lower:
-            return {"code": templates[language].get("function", "// Template not available"), 
-                   "explanation": "Generated function template"}
-        elif "class" in prompt_lower and language == "python":
-            return {"code": templates[language].get("class", "# Template not available"), 
-                   "explanation": "Generated class template"}
+    result = await request_completion(cache_key, system_prompt, user_message, request_type)
+    if embedding is not None:
+        await store_semantic_response(cache_key, request_type, language, embedding, result)
+    return result
+
+def finish_inflight(cache_key: str, task: asyncio.Task) -> None:
+    INFLIGHT.pop(cache_key, None)
+    # Mark a failure retrieved in case every waiter has gone away
+    if not task.cancelled():
+        task.exception()
+
+async def stream_code_with_ai(prompt: str, language: str, request_type: str, code_input: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Stream a completion as ("delta", text) events followed by one ("result", dict)"""
+    streamed = False
+    try:
+        if not openai_client:
+            # Fallback templates when no API key
+            yield "result", await get_template_code(prompt, language, request_type)
+            return
+        
+        system_prompt, user_message = build_messages(prompt, language, request_type, code_input, structured=False)
+        cache_key = llm_cache_key(system_prompt, prompt, language, request_type, code_input, structured=False)
+        cached = await get_cached_response(cache_key)
+        if cached:
+            yield "result", cached
+            return
+        
+        await acquire_rate_limit(system_prompt, user_message)
+        chunks = []
+        async with OPENAI_SEM:
+            stream = await openai_client.chat.completions.create(
+                **completion_params(system_prompt, user_message, request_type, structured=False),
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    chunks.append(delta)
+                    streamed = True
+                    yield "delta", delta
+        
+        result = parse_ai_response(request_type, "".join(chunks), structured=False)
+        await store_cached_response(cache_key, result)
+        yield "result", result
+    
+    except CacheMissError:
+        raise
+    except Exception as e:
+        # Once tokens reached the client a template can no longer stand in
+        if streamed:
+            raise
+        logging.error(f"AI generation error: {str(e)}")
+        yield "result", await get_template_code(prompt, language, request_type)
+
+async def generate_code_with_ai(prompt: str, language: str, request_type: str, code_input: Optional[str] = None) -> Dict[str, str]:
+    """Generate code using OpenAI GPT"""
+    try:
+        if not openai_client:
+            # Fallback templates when no API key
+            return await get_template_code(prompt, language, request_type)
+        
+        system_prompt, user_message = build_messages(prompt, language, request_type, code_input)
+        
+        cache_key = llm_cache_key(system_prompt, prompt, language, request_type, code_input)
+        cached = await get_cached_response(cache_key)
+        if cached:
+            return cached
+        
+        # Identical concurrent requests share one outstanding lookup (embedding,
+        # semantic match, then OpenAI call). It runs in its own task so no single
+        # request owns it, and every caller awaits it through a shield so a
+        # disconnecting caller cannot cancel it.
+        inflight = INFLIGHT.get(cache_key)
+        if inflight is None:
+            inflight = asyncio.create_task(
+                complete_uncached(cache_key, prompt, system_prompt, user_message, request_type, language, code_input)
+            )
+            INFLIGHT[cache_key] = inflight
+            inflight.add_done_callback(lambda task: finish_inflight(cache_key, task))
+        return await asyncio.shield(inflight)
+        
+    except (CacheMissError, CompletionError):
+        raise
+    except Exception as e:
+        logging.error(f"AI generation error: {str(e)}")
+        return await get_template_code(prompt, language, request_type)
+
+async def get_template_code(prompt: str, language: str, request_type: str) -> Dict[str, str]:
+    """Fallback template-based code generation"""
+    templates = TEMPLATES.get(language)
+    if templates:
+        tags = {match.lastgroup for match in TEMPLATE_CLASSIFIER.finditer(prompt)}
+        for tag in TEMPLATE_PRIORITY:
+            # Only Python has a class template; elsewhere "class" falls through
+            if tag in tags and (tag != "class" or language == "python"):
+                return {"code": templates.get(tag, "// Template not available"),
+                       "explanation": TEMPLATE_EXPLANATIONS[tag]}
     
     return {"code": f"// {language.title()} code for: {prompt}\n// Template-based generation - please provide OpenAI API key for advanced features", 
            "explanation": "Basic template generated. For advanced AI-powered code generation, please configure OpenAI API key."}
@@ -271,29 +821,34 @@ async def root():
 async def generate_code(request: CodeRequestCreate):
     """Generate code based on natural language prompt"""
     try:
-        # Save request to database
-        code_request = CodeRequest(**request.dict())
-        await db.code_requests.insert_one(code_request.dict())
+        # Save request to database; the document mirrors CodeRequest
+        request_doc = request.model_dump()
+        request_doc["id"] = str(uuid.uuid4())
+        request_doc["timestamp"] = datetime.now(timezone.utc)
+        await enqueue_write("code_requests", request_doc)
         
         # Generate code using AI
-        result = await generate_code_with_ai(
-            request.prompt, 
-            request.language, 
-            request.request_type,
-            request.code_input
-        )
+        async with ENDPOINT_SEM:
+            result = await generate_code_with_ai(
+                request.prompt, 
+                request.language, 
+                request.request_type,
+                request.code_input
+            )
         
-        # Create response
-        response = CodeResponse(
-            id=str(uuid.uuid4()),
-            request_id=code_request.id,
-            generated_code=result["code"],
-            explanation=result["explanation"],
-            language=request.language
-        )
+        # Create response; FastAPI validates it against CodeResponse once on the way out
+        response = {
+            "id": str(uuid.uuid4()),
+            "request_id": request_doc["id"],
+            "generated_code": result["code"],
+            "explanation": result["explanation"],
+            "language": request.language,
+            "cache_key": result.get("cache_key"),
+            "timestamp": datetime.now(timezone.utc)
+        }
         
-        # Save response to database
-        await db.code_responses.insert_one(response.dict())
+        # Save response to database; insert_many adds _id to the queued copy
+        await enqueue_write("code_responses", {**response})
         
         return response
         
@@ -301,6 +856,57 @@ async def generate_code(request: CodeRequestCreate):
         logging.error(f"Code generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Code generation failed: {str(e)}")
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    # orjson serializes the datetime fields natively
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+@api_router.post("/generate-code/stream")
+async def generate_code_stream(request: CodeRequestCreate):
+    """Stream generated code as Server-Sent Events: delta events, then done or error"""
+    request_doc = request.model_dump()
+    request_doc["id"] = str(uuid.uuid4())
+    request_doc["timestamp"] = datetime.now(timezone.utc)
+    await enqueue_write("code_requests", request_doc)
+    
+    async def event_stream():
+        result = None
+        try:
+            async with ENDPOINT_SEM:
+                async for kind, payload in stream_code_with_ai(
+                    request.prompt,
+                    request.language,
+                    request.request_type,
+                    request.code_input
+                ):
+                    if kind == "delta":
+                        yield sse_event("delta", {"content": payload})
+                    else:
+                        result = payload
+        except Exception as e:
+            logging.error(f"Code generation error: {str(e)}")
+            yield sse_event("error", {"detail": f"Code generation failed: {str(e)}"})
+            return
+        
+        response = {
+            "id": str(uuid.uuid4()),
+            "request_id": request_doc["id"],
+            "generated_code": result["code"],
+            "explanation": result["explanation"],
+            "language": request.language,
+            "cache_key": None,
+            "timestamp": datetime.now(timezone.utc)
+        }
+        done_event = sse_event("done", response)
+        await enqueue_write("code_responses", response)
+        yield done_event
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Keep proxies such as nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.post("/debug-code")
 async def debug_code(request: DebugRequest):
     """Debug and fix code issues"""
@@ -309,12 +915,13 @@ async def debug_code(request: DebugRequest):
         if request.error_message:
             prompt += f" that gives this error: {request.error_message}"
         
-        result = await generate_code_with_ai(
-            prompt,
-            request.language,
-            "debug",
-            request.code
-        )
+        async with ENDPOINT_SEM:
+            result = await generate_code_with_ai(
+                prompt,
+                request.language,
+                "debug",
+                request.code
+            )
         
         return {
             "original_code": request.code,
@@ -333,12 +940,13 @@ async def optimize_code(request: OptimizeRequest):
     try:
         prompt = f"Optimize this {request.language} code for {request.optimization_type}"
         
-        result = await generate_code_with_ai(
-            prompt,
-            request.language,
-            "optimize",
-            request.code
-        )
+        async with ENDPOINT_SEM:
+            result = await generate_code_with_ai(
+                prompt,
+                request.language,
+                "optimize",
+                request.code
+            )
         
         return {
             "original_code": request.code,
@@ -353,31 +961,52 @@ async def optimize_code(request: OptimizeRequest):
         raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
 
 @api_router.post("/explain-code")
-async def explain_code(code: str, language: str):
+async def explain_code(request: ExplainRequest):
     """Explain what the code does"""
     try:
-        result = await generate_code_with_ai(
-            "Explain this code in detail",
-            language,
-            "explain",
-            code
-        )
+        async with ENDPOINT_SEM:
+            result = await generate_code_with_ai(
+                "Explain this code in detail",
+                request.language,
+                "explain",
+                request.code
+            )
         
         return {
-            "code": code,
+            "code": request.code,
             "explanation": result["explanation"],
-            "language": language
+            "language": request.language
         }
         
     except Exception as e:
         logging.error(f"Explanation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Explanation failed: {str(e)}")
 
+@api_router.post("/cache-feedback")
+async def cache_feedback(feedback: CacheFeedback):
+    """Rate a semantic cache hit to tune the similarity threshold"""
+    try:
+        # Only keys of real semantic cache entries may move the threshold
+        known = feedback.cache_key in semantic_cache or await db.llm_semantic_cache.find_one(
+            {"_id": feedback.cache_key}, projection={"_id": 1}
+        ) is not None
+        if known:
+            await db.cache_feedback.insert_one({**feedback.model_dump(), "ts": datetime.now(timezone.utc)})
+    except Exception as e:
+        logging.error(f"Cache feedback error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to record feedback: {str(e)}")
+    if not known:
+        raise HTTPException(status_code=404, detail="Unknown cache key")
+    return {"status": "recorded"}
+
+# Only the fields CodeRequest needs
+HISTORY_PROJECTION = {"_id": 0, **{field: 1 for field in CodeRequest.model_fields}}
+
 @api_router.get("/code-history", response_model=List[CodeRequest])
 async def get_code_history(limit: int = 50):
     """Get recent code generation history"""
     try:
-        requests = await db.code_requests.find().sort("timestamp", -1).limit(limit).to_list(limit)
+        requests = await db.code_requests.find({}, projection=HISTORY_PROJECTION).sort("timestamp", -1).limit(limit).to_list(limit)
         return [CodeRequest(**request) for request in requests]
     except Exception as e:
         logging.error(f"History retrieval error: {str(e)}")
@@ -409,25 +1038,134 @@ async def get_supported_languages():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Middleware policy: write middleware as plain ASGI callables like
+# LogMiddleware below and register them with app.add_middleware. Never
+# subclass starlette's BaseHTTPMiddleware; its per-request task and body
+# re-wrapping costs a large share of throughput.
+class LogMiddleware:
+    """Log method, path, status and latency of every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start = time.perf_counter()
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            logger.info(f'{scope["method"]} {scope["path"]} {status_code} {duration_ms:.1f}ms')
+
+app.add_middleware(LogMiddleware)
+
+# CORS: ALLOWED_ORIGINS is a comma-separated list, and ALLOWED_ORIGIN_REGEX
+# optionally matches more (compiled once by the middleware). Credentials are
+# only allowed with explicit origins; a wildcard must not be combined with them.
+ALLOWED_ORIGINS = [origin.strip() for origin in os.environ.get('ALLOWED_ORIGINS', '*').split(',') if origin.strip()]
+ALLOWED_ORIGIN_REGEX = os.environ.get('ALLOWED_ORIGIN_REGEX') or None
+
 app.add_middleware(
     CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_credentials="*" not in ALLOWED_ORIGINS,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_origin_regex=ALLOWED_ORIGIN_REGEX,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
 )
 
 # Configure logging
+# The root logger only enqueues records; a QueueListener thread does the
+# actual stream I/O so logging never blocks the event loop
+log_queue = queue.Queue(-1)
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = QueueListener(log_queue, log_stream_handler, respect_handler_level=True)
+log_queue_handler = QueueHandler(log_queue)
+# Pass the bare message through; the stream handler applies the real format
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    handlers=[log_queue_handler]
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_log_listener():
+    log_listener.start()
+
+@app.on_event("startup")
+async def check_rate_limit_config():
+    if bool(OPENAI_RPM) != bool(OPENAI_TPM):
+        logging.warning("OpenAI rate limiting disabled: set both OPENAI_RPM and OPENAI_TPM to enable it")
+
+@app.on_event("startup")
+async def create_indexes():
+    try:
+        # Serves the newest-first sort in get_code_history
+        await db.code_requests.create_index([("timestamp", -1)])
+        await db.code_responses.create_index([("request_id", 1)])
+    except Exception as e:
+        logging.error(f"Index creation error: {str(e)}")
+
+@app.on_event("startup")
+async def start_background_writer():
+    app.state.write_drainer = asyncio.create_task(drain_write_queue())
+
+@app.on_event("startup")
+async def start_semantic_cache():
+    if not SEMANTIC_CACHE:
+        return
+    try:
+        await db.cache_feedback.create_index([("ts", 1)])
+        await db.llm_semantic_cache.create_index([("ts", -1)])
+        await sync_semantic_cache()
+    except Exception as e:
+        logging.error(f"Semantic cache load error: {str(e)}")
+    app.state.semantic_tuner = asyncio.create_task(tune_semantic_cache())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    if getattr(app.state, "semantic_tuner", None):
+        app.state.semantic_tuner.cancel()
+    if getattr(app.state, "write_drainer", None):
+        # Let the drainer finish the batch it already dequeued, then stop
+        await write_queue.put(None)
+        await app.state.write_drainer
+    # Flush whatever was queued behind the stop marker before the connection goes away
+    pending = []
+    while not write_queue.empty():
+        item = write_queue.get_nowait()
+        if item is not None:
+            pending.append(item)
+    if pending:
+        await flush_writes(pending)
+    mongo_client.close()
+    if openai_http_client:
+        await openai_http_client.aclose()
+    log_listener.stop()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # Production deployments can instead run gunicorn -k uvicorn.workers.UvicornWorker;
+    # either way WEB_CONCURRENCY must match the worker count for the rate limiter
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="uvloop",
+        http="httptools",
+        workers=WEB_CONCURRENCY,
+        access_log=False
+    )
\ No newline at end of file
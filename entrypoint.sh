@@ -5,8 +5,12 @@ set -e
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
 echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+# Start Uvicorn with proper host binding, on the same loop, HTTP parser and
+# worker count as server.py's __main__ block; WEB_CONCURRENCY also feeds the
+# per-worker OpenAI rate limits, so it must match --workers
+uvicorn server:app --host 0.0.0.0 --port 8001 \
+    --loop uvloop --http httptools --no-access-log \
+    --workers "${WEB_CONCURRENCY:-1}" &
 BACKEND_PID=$!
 
 echo "Waiting for backend to start..."
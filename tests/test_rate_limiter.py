@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from backend import server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock that asyncio.sleep inside the bucket advances"""
+    now = [0.0]
+
+    async def fake_sleep(delay):
+        now[0] += delay
+
+    monkeypatch.setattr(server, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(server, "asyncio", SimpleNamespace(Lock=asyncio.Lock, sleep=fake_sleep))
+    return now
+
+
+def count_admissions(clock, requests_per_minute, tokens_per_minute, estimated_tokens, minutes=60):
+    async def run():
+        bucket = server.OpenAITokenBucket(requests_per_minute, tokens_per_minute)
+        admitted = 0
+        while True:
+            await bucket.acquire(estimated_tokens)
+            if clock[0] >= minutes * 60:
+                return admitted
+            admitted += 1
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("rpm, tpm, estimated", [
+    (0.5, 100_000, 100),   # request share below one call per minute
+    (60, 2_500, 3_500),    # every call larger than the whole TPM share
+    (10, 100_000, 100),
+])
+def test_admissions_stay_within_share(clock, rpm, tpm, estimated):
+    minutes = 60
+    admitted = count_admissions(clock, rpm, tpm, estimated, minutes)
+
+    # Long-run rate is bounded by both shares, plus one initial full bucket
+    assert admitted <= rpm * minutes + max(rpm, 1)
+    assert admitted * estimated <= tpm * minutes + max(tpm, estimated)
+    # and the bucket never stalls
+    assert admitted >= min(rpm, tpm / estimated) * minutes - 1